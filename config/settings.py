@@ -47,6 +47,7 @@ API_TOKEN = os.getenv('API_TOKEN')
 API_CONFIG = {
     "host": "0.0.0.0", #"127.0.0.1",
     "port": 8000,
+    "workers": int(os.getenv("API_WORKERS", "1")), # >1 : nécessite PROMETHEUS_MULTIPROC_DIR
     "token": API_TOKEN,
     "model_path": MODELS_DIR / "cats_dogs_model.keras",
 }
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """Script de lancement de l'API"""
 
+import os
 import sys
 from pathlib import Path
 
@@ -16,9 +17,18 @@ if __name__ == "__main__":
     print(f"URL: http://{API_CONFIG['host']}:{API_CONFIG['port']}")
     print(f"Docs: http://{API_CONFIG['host']}:{API_CONFIG['port']}/docs")
     
+    # Mode multiprocess Prometheus : répertoire partagé par les workers,
+    # vidé au démarrage (les fichiers .db d'un run précédent fausseraient les compteurs)
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        Path(multiproc_dir).mkdir(parents=True, exist_ok=True)
+        for stale in Path(multiproc_dir).glob("*.db"):
+            stale.unlink()
+    
     uvicorn.run(
         "src.api.main:app",
         host=API_CONFIG["host"],
         port=API_CONFIG["port"],
+        workers=API_CONFIG["workers"],
         reload=False  # En production Docker
     )
\ No newline at end of file
@@ -32,6 +32,7 @@ from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
+import logging
 import sys
 from pathlib import Path
 import time
@@ -90,8 +91,10 @@ alert_database_disconnected = None
 notifier = None
 track_prediction = None
 track_feedback = None
+track_user_feedback = None
 update_db_status = None
 track_inference_time = None
+update_last_inference_ns = None
 inference_duration = None  # 🆕 Histogramme temps inférence
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -102,11 +105,11 @@ if ENABLE_PROMETHEUS:
         from src.monitoring.prometheus_metrics import (
             track_prediction,
             track_inference_time,
-            update_last_inference,
-            inc_http_request,  # 🆕 AJOUT
+            update_last_inference_ns,
             update_db_status,
             inference_duration,
-            track_feedback
+            track_feedback,
+            track_user_feedback
         )
         print("✅ Prometheus tracking functions loaded")
     except ImportError as e:
@@ -144,6 +147,9 @@ templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 # ─────────────────────────────────────────────────────────────────────────────
 router = APIRouter()
 # 📌 Router FastAPI (groupage des endpoints)
+
+logger = logging.getLogger("cv.api")
+# 📝 Logs du chemin /api/predict (formatage %-style différé, pas de flush stderr)
 # Sera inclus dans main.py : app.include_router(router)
 
 predictor = CatDogPredictor()
@@ -268,16 +274,16 @@ async def predict_api(
     # ─────────────────────────────────────────────────────────────────────────
     # ⏱️ MESURE TEMPS D'INFÉRENCE (début)
     # ─────────────────────────────────────────────────────────────────────────
-    start_time = time.perf_counter()
-    # perf_counter() : horloge haute précision (nanoseconde sur Linux)
+    start_time_ns = time.perf_counter_ns()
+    # perf_counter_ns() : horloge haute précision, entier en nanosecondes
+    # (pas d'arrondi flottant ; seuils comparés en arithmétique entière)
     # Alternative : time.time() (moins précis, impacté par ajustements NTP)
     
     try:
         # ─────────────────────────────────────────────────────────────────────
         # 📸 LECTURE ET PRÉDICTION
         # ─────────────────────────────────────────────────────────────────────
-        import sys
-        print("🔬 DÉBUT PREDICTION", file=sys.stderr, flush=True)
+        logger.debug("Début prédiction")
         image_data = await file.read()
         # 📥 Lecture asynchrone du fichier uploadé (bytes)
         
@@ -292,10 +298,10 @@ async def predict_api(
         # ─────────────────────────────────────────────────────────────────────
         # ⏱️ CALCUL TEMPS D'INFÉRENCE (fin)
         # ─────────────────────────────────────────────────────────────────────
-        end_time = time.perf_counter()
-        inference_time_ms = int((end_time - start_time) * 1000)
+        inference_time_ns = time.perf_counter_ns() - start_time_ns
+        inference_time_ms = inference_time_ns // 1_000_000
         
-        # Conversion secondes → millisecondes (plus lisible pour latence)
+        # Conversion nanosecondes → millisecondes (plus lisible pour latence)
         # Typage int : évite JSON avec .567823478 ms
         
         # ─────────────────────────────────────────────────────────────────────
@@ -324,44 +330,35 @@ async def predict_api(
         # ─────────────────────────────────────────────────────────────────────
         # 📊 TRACKING PROMETHEUS (V3 - nouveau)
         # ─────────────────────────────────────────────────────────────────────
-        import sys
-        print(f"🔍 DEBUG: ENABLE_PROMETHEUS={ENABLE_PROMETHEUS}, track_prediction={track_prediction is not None}, track_inference_time={track_inference_time is not None}", file=sys.stderr, flush=True)
         if ENABLE_PROMETHEUS:
             try:
                 # If only inference latency should be recorded (no full prediction tracking)
                 if track_inference_time and not track_prediction:
-                    print(f"📊 Tracking inference time only: {inference_time_ms}ms", file=sys.stderr, flush=True)
-                    track_inference_time(inference_time_ms / 1000.0)  # Convert ms to seconds
-                    print("✅ Prometheus inference-time tracking successful", file=sys.stderr, flush=True)
+                    logger.debug("Tracking inference time only: %dms", inference_time_ms)
+                    track_inference_time(inference_time_ns * 1e-9)  # Convert ns to seconds
 
                 # If full prediction tracking is available, use it (it already records inference time)
                 if track_prediction:
-                    print(f"📊 Tracking prediction: {result['prediction'].lower()}, {inference_time_ms}ms, {result['confidence']}", file=sys.stderr, flush=True)
+                    logger.debug("Tracking prediction: %s, %dms, %s",
+                                 result["prediction"], inference_time_ms, result["confidence"])
                     track_prediction(
                         result=result["prediction"].lower(),
-                        inference_time_ms=inference_time_ms,
+                        inference_time_ns=inference_time_ns,
                         confidence=result['confidence'],
                         success=True
                     )
-                    print("✅ Prometheus tracking successful", file=sys.stderr, flush=True)
-            except Exception as e:
-                print(f"⚠️  Prometheus tracking failed: {e}", file=sys.stderr, flush=True)
-                import traceback
-                traceback.print_exc(file=sys.stderr)
+            except Exception:
+                logger.warning("Prometheus tracking failed", exc_info=True)
                 # Non-bloquant : on continue même si tracking échoue
         
-        # Mesure du temps d'inférence
-        inference_duration = end_time - start_time
-
         # ═════════════════════════════════════════════════════════════════════
         # 🆕 📊 TRACKING PROMETHEUS - Dernière latence
         # ═════════════════════════════════════════════════════════════════════
-        if ENABLE_PROMETHEUS and update_last_inference:
+        if ENABLE_PROMETHEUS and update_last_inference_ns:
             try:
-                update_last_inference(inference_duration)
-                print(f"✅ Updated last inference gauge: {inference_duration:.3f}s", file=sys.stderr, flush=True)
+                update_last_inference_ns(inference_time_ns)
             except Exception as e:
-                print(f"⚠️  Failed to update last inference: {e}", file=sys.stderr, flush=True)
+                logger.warning("Failed to update last inference: %s", e)
 
         # 📝 Retourne objet ORM PredictionFeedback avec .id auto-généré
         
@@ -379,22 +376,16 @@ async def predict_api(
             "inference_time_ms": inference_time_ms,
             "feedback_id": feedback_record.id  # Pour update feedback ultérieur
         }
-        
-        # Utilisation dans le handler POST /api/predict
-        if ENABLE_PROMETHEUS:
-            try:
-                inc_http_request("POST", "/api/predict")
-            except Exception:
-                pass
 
+        # 💡 cv_http_requests_total est incrémenté par PrometheusMiddleware
         return response_data
         
     except Exception as e:
         # ─────────────────────────────────────────────────────────────────────
         # 🚨 GESTION ERREURS (logging même en cas d'échec)
         # ─────────────────────────────────────────────────────────────────────
-        end_time = time.perf_counter()
-        inference_time_ms = int((end_time - start_time) * 1000)
+        inference_time_ns = time.perf_counter_ns() - start_time_ns
+        inference_time_ms = inference_time_ns // 1_000_000
         
         # 💾 Enregistrement de l'erreur en base (audit trail)
         try:
@@ -416,7 +407,7 @@ async def predict_api(
                 try:
                     track_prediction(
                         result="error",
-                        inference_time_ms=inference_time_ms,
+                        inference_time_ns=inference_time_ns,
                         confidence=0.0,
                         success=False
                     )
@@ -499,7 +490,7 @@ async def update_feedback(
         # ═════════════════════════════════════════════════════════════════════
         # 🆕 📊 TRACKING PROMETHEUS
         # ═════════════════════════════════════════════════════════════════════
-        if ENABLE_PROMETHEUS and track_user_feedback:
+        if ENABLE_PROMETHEUS and track_user_feedback and user_feedback is not None:
             try:
                 # Convertir 0/1 en label 'negative'/'positive'
                 feedback_type = 'positive' if user_feedback == 1 else 'negative'
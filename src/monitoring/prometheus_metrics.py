@@ -20,19 +20,41 @@ Il illustre comment instrumenter une application ML pour le monitoring productio
 
 ═══════════════════════════════════════════════════════════════════════════════
 """
-from prometheus_client import Counter, Histogram, Gauge
-from prometheus_fastapi_instrumentator import Instrumentator
+from prometheus_client import Counter, Histogram, Gauge, REGISTRY
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from starlette.routing import Match
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+import asyncio
+import atexit
+import logging
+import math
 import os
+import queue
 import sys  # 🆕 AJOUT
+import tempfile
+import threading
+import time
 
-# Conditional import for Discord alerting
-alert_high_latency = None
-try:
-    from src.monitoring.discord_notifier import alert_high_latency as _alert_high_latency
-    alert_high_latency = _alert_high_latency
-    print("✅ Discord alert_high_latency imported", file=sys.stderr, flush=True)
-except ImportError:
-    print("⚠️ Discord alerting not available", file=sys.stderr, flush=True)
+# 📝 Logger du module : remplace les print(..., flush=True) sur le hot path
+# (formatage %-style différé, ignoré si le niveau DEBUG est désactivé)
+logger = logging.getLogger("cv.metrics")
+logger.setLevel(logging.INFO)
+
+# Lazy import for Discord alerting (requests/dotenv chargés au 1er besoin)
+@lru_cache(maxsize=1)
+def _load_alert_high_latency():
+    """Retourne discord_notifier.alert_high_latency, ou None si indisponible."""
+    try:
+        from src.monitoring.discord_notifier import alert_high_latency
+    except ImportError:
+        logger.warning("Discord alerting not available")
+        return None
+    return alert_high_latency
 
 # ═══════════════════════════════════════════════════════════════════════════
 # 📊 MÉTRIQUES CUSTOM - Spécifiques au modèle CV cats/dogs
@@ -43,8 +65,10 @@ except ImportError:
 # ─────────────────────────────────────────────────────────────────────────────
 database_status = Gauge(
     'cv_database_connected',
-    'Database connection status (1=connected, 0=disconnected)'
+    'Database connection status (1=connected, 0=disconnected)',
+    multiprocess_mode='livemin'
 )
+# 🔀 'livemin' : un seul worker déconnecté suffit à exposer 0 (alerte == 0)
 # 💡 USAGE
 # - .set(1) : marque comme connecté
 # - .set(0) : marque comme déconnecté
@@ -75,20 +99,41 @@ predictions_total = Counter(
 # - rate(cv_predictions_total[5m]) : prédictions par seconde
 # - sum by (result)(cv_predictions_total) : total par classe
 
+# ⚡ LABELS PRÉ-RÉSOLUS (hot path /api/predict)
+# .labels() hashe le tuple de labels + lookup dict à chaque appel :
+# on matérialise une fois pour toutes les combinaisons connues.
+_PRED_CAT_OK = predictions_total.labels(result='cat', success='true')
+_PRED_CAT_FAIL = predictions_total.labels(result='cat', success='false')
+_PRED_DOG_OK = predictions_total.labels(result='dog', success='true')
+_PRED_DOG_FAIL = predictions_total.labels(result='dog', success='false')
+_PRED_ERR_OK = predictions_total.labels(result='error', success='true')
+_PRED_ERR_FAIL = predictions_total.labels(result='error', success='false')
+
+_PRED = {
+    ('cat', True): _PRED_CAT_OK,
+    ('cat', False): _PRED_CAT_FAIL,
+    ('dog', True): _PRED_DOG_OK,
+    ('dog', False): _PRED_DOG_FAIL,
+    ('error', True): _PRED_ERR_OK,
+    ('error', False): _PRED_ERR_FAIL,
+}
+
 # ─────────────────────────────────────────────────────────────────────────────
 # 📊 HISTOGRAM : Distribution des valeurs (latence, confiance, etc.)
 # ─────────────────────────────────────────────────────────────────────────────
 inference_duration = Histogram(
     'cv_inference_duration_seconds',
     'Inference time in seconds',
-    buckets=[0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+    buckets=[0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0]
 )
 # 💡 BUCKETS
 # Définissent les intervalles de temps (en secondes)
-# [0.1, 0.25, 0.5, 1.0, ...] permet de mesurer :
-# - Combien de prédictions < 100ms
-# - Combien entre 100ms et 250ms
+# [0.05, 0.1, 0.15, ...] permet de mesurer :
+# - Combien de prédictions < 50ms
+# - Combien entre 50ms et 100ms
 # - etc.
+# Calibrés sur les latences observées du CNN (p50-p99 ≈ 50-400ms) :
+# au-delà de 1s tout tombe dans +Inf (seuil d'alerte cv_inferencetime_ms)
 #
 # 🎯 USAGE
 # with inference_duration.time():
@@ -98,37 +143,106 @@ inference_duration = Histogram(
 # - histogram_quantile(0.95, cv_inference_duration_seconds) : P95 latence
 # - avg(cv_inference_duration_seconds_sum / cv_inference_duration_seconds_count) : moyenne
 
-prediction_confidence = Histogram(
-    'cv_prediction_confidence',
-    'Model confidence score',
-    labelnames=['result'],
-    buckets=[0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, 1.0]
+class ConfidenceQuantileCollector:
+    """
+    Quantiles de confiance sur une fenêtre glissante des N dernières prédictions
+
+    💡 POURQUOI PAS UN HISTOGRAM ?
+    Un Histogram incrémente chaque bucket + _sum + _count à chaque
+    observation. Ici : un seul append dans un deque borné ; le tri et le
+    calcul des quantiles n'ont lieu qu'au scrape.
+    """
+
+    QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+    def __init__(self, window: int = 1000):
+        self._values = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self._values.append(value)  # Atomique (GIL) : pas de lock nécessaire
+
+    def describe(self):
+        return [self._family()]
+
+    def collect(self):
+        family = self._family()
+        values = sorted(self._values)
+        if values:
+            for q in self.QUANTILES:
+                # Nearest-rank : plus petite valeur couvrant q * n observations
+                index = max(0, math.ceil(q * len(values)) - 1)
+                family.add_metric([str(q)], values[index])
+        yield family
+
+    @staticmethod
+    def _family():
+        return GaugeMetricFamily(
+            'cv_prediction_confidence_quantile',
+            'Model confidence score quantiles (sliding window)',
+            labels=['quantile']
+        )
+
+prediction_confidence = ConfidenceQuantileCollector(
+    window=int(os.getenv('CONFIDENCE_WINDOW', '1000'))
 )
+REGISTRY.register(prediction_confidence)
 # 💡 TRACKING CONFIANCE
 # Permet de détecter si le modèle devient moins sûr → drift potentiel
+# Sans label 'result' : la répartition cat/dog reste dans cv_predictions_total
 #
 # 📈 QUERY PROMQL
-# - histogram_quantile(0.5, cv_prediction_confidence) : médiane confiance
+# - cv_prediction_confidence_quantile{quantile="0.5"} : médiane confiance
 
 # 🆕 FEEDBACK UTILISATEUR
 cv_user_feedback_positive = Gauge(
     'cv_user_feedback_positive',
     'Total positive feedbacks (thumbs up)',
-    labelnames=['result']  # Labels: cat, dog
+    labelnames=['result'],  # Labels: cat, dog
+    multiprocess_mode='livemax'
 )
 
 cv_user_feedback_negative = Gauge(
     'cv_user_feedback_negative',
     'Total negative feedbacks (thumbs down)',
-    labelnames=['result']  # Labels: cat, dog
+    labelnames=['result'],  # Labels: cat, dog
+    multiprocess_mode='livemax'
 )
 
 cv_user_feedback_total = Gauge(
     'cv_user_feedback_total',
     'Total feedbacks collected (positive + negative)',
-    labelnames=['result']
+    labelnames=['result'],
+    multiprocess_mode='livemax'
 )
 
+# 🆕 FEEDBACK EN TEMPS RÉEL (👍/👎 via /api/update-feedback)
+# Distinct des Gauges ci-dessus (recalculées depuis la DB par track_feedback)
+cv_feedback_submitted_total = Counter(
+    'cv_feedback_submitted_total',
+    'User feedbacks submitted through the API',
+    labelnames=['feedback_type']  # Labels: positive, negative
+)
+
+# ⚡ Dispatch dict : validation O(1) + enfants pré-résolus
+_FEEDBACK_CHILDREN = {
+    'positive': cv_feedback_submitted_total.labels(feedback_type='positive'),
+    'negative': cv_feedback_submitted_total.labels(feedback_type='negative'),
+}
+
+def track_user_feedback(feedback_type: str):
+    """
+    Incrémente le compteur de feedbacks soumis
+
+    🔗 APPELÉ PAR : /api/update-feedback
+
+    Args:
+        feedback_type: 'positive' ou 'negative'
+    """
+    if feedback_type not in _FEEDBACK_CHILDREN:
+        logger.warning("Unknown feedback type: %s", feedback_type)
+        return
+    _enqueue(("feedback", feedback_type))
+
 def track_feedback():
     """
     Récupère les feedbacks de la DB et met à jour les métriques.
@@ -193,41 +307,139 @@ def track_feedback():
 
 cv_last_inference_seconds = Gauge(
     'cv_last_inference_seconds',
-    'Inference time (seconds) for the most recent request'
+    'Inference time (seconds) for the most recent request',
+    multiprocess_mode='livemax'
 )
 
 # 🆕 AVERAGE INFERENCE TIME
-cv_avg_inference_seconds = Gauge(
-    'cv_avg_inference_seconds',
-    'Average inference time (seconds) for all predictions'
-)
+class AvgInferenceCollector:
+    """
+    Expose cv_avg_inference_seconds calculée au moment du scrape
+
+    💡 POURQUOI UN COLLECTOR ?
+    L'histogramme inference_duration connaît déjà la somme et le nombre
+    d'observations : inutile de maintenir un doublon (sum/count globaux)
+    mis à jour à chaque prédiction. La division n'a lieu qu'au scrape.
+
+    🔀 MODE MULTIPROCESS : voir AggregatedCollector (moyenne calculée à
+    partir des _sum/_count agrégés sur tous les workers).
+    """
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def _sum_and_count(self):
+        total = self._histogram._sum.get()
+        count = sum(bucket.get() for bucket in self._histogram._buckets)
+        return total, count
+
+    @staticmethod
+    def sum_and_count_from(families, name):
+        """Somme et nombre d'observations d'un histogramme parmi des familles déjà collectées."""
+        total = count = 0.0
+        for family in families:
+            if family.name != name:
+                continue
+            for sample in family.samples:
+                if sample.name == name + '_sum':
+                    total += sample.value
+                elif sample.name == name + '_count':
+                    count += sample.value
+        return total, count
+
+    @staticmethod
+    def family(total, count):
+        return GaugeMetricFamily(
+            'cv_avg_inference_seconds',
+            'Average inference time (seconds) for all predictions',
+            value=total / count if count else 0.0
+        )
+
+    def describe(self):
+        return [GaugeMetricFamily(
+            'cv_avg_inference_seconds',
+            'Average inference time (seconds) for all predictions'
+        )]
+
+    def collect(self):
+        yield self.family(*self._sum_and_count())
+
+cv_avg_inference_seconds = AvgInferenceCollector(inference_duration)
+REGISTRY.register(cv_avg_inference_seconds)
 
 # 🆕 INFERENCE TIME IN MS FOR ALERTING
-cv_inferencetime_ms = Gauge(
-    'cv_inferencetime_ms',
-    'Latest inference time in milliseconds (for alerting)'
-)
+class InferenceMsCollector:
+    """
+    Expose cv_inferencetime_ms dérivée de cv_last_inference_seconds au scrape
 
-def update_last_inference(duration: float):
-    print(f"DEBUG: update_last_inference called with {duration}", file=sys.stderr, flush=True)
+    💡 Une seule Gauge écrite par requête (en secondes) : la version en
+    millisecondes (utilisée par l'alerte HighInferenceLatency) est calculée
+    uniquement lors du scrape.
+    """
+
+    def __init__(self, gauge):
+        self._gauge = gauge
+
+    def describe(self):
+        return [self._family()]
+
+    def collect(self):
+        yield self._family(self._gauge._value.get() * 1000.0)
+
+    @staticmethod
+    def _family(value=None):
+        return GaugeMetricFamily(
+            'cv_inferencetime_ms',
+            'Latest inference time in milliseconds (for alerting)',
+            value=value
+        )
+
+cv_inferencetime_ms = InferenceMsCollector(cv_last_inference_seconds)
+REGISTRY.register(cv_inferencetime_ms)
+
+# 🚨 ALERTE LATENCE : au plus 1 webhook Discord par fenêtre de cooldown,
+# envoyé hors du chemin de la requête (thread dédié)
+_ALERT_COOLDOWN_S = float(os.getenv('LATENCY_ALERT_COOLDOWN_S', '60'))
+_last_alert_ts = float('-inf')  # Première alerte jamais bloquée par le cooldown
+_alert_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cv-alert")
+
+def _send_latency_alert(ms: int):
+    """Exécuté dans _alert_executor : import Discord + webhook hors requête."""
+    alert_high_latency = _load_alert_high_latency()
+    if alert_high_latency:
+        alert_high_latency(ms, threshold=1000)
+
+def update_last_inference_ns(duration_ns: int):
+    """
+    Met à jour la dernière latence à partir d'une durée entière en ns
+
+    💡 Mesurer avec time.perf_counter_ns() : une seule conversion
+    flottante, et le seuil d'alerte devient une comparaison entière.
+    """
+    global _last_alert_ts
     try:
-        # Update both metrics
-        cv_last_inference_seconds.set(duration)
-        cv_inferencetime_ms.set(duration * 1000)  # Convert seconds to milliseconds
+        # cv_inferencetime_ms en est dérivée au scrape (InferenceMsCollector)
+        cv_last_inference_seconds.set(duration_ns * 1e-9)
         
-        print(f"✅ Updated inference metrics: {duration:.3f}s / {duration*1000:.0f}ms")
+        logger.debug("Updated inference metrics: %dns", duration_ns)
         
-        # Check for high latency alert
-        if alert_high_latency and duration * 1000 > 1000:  # 1000ms threshold
-            print(f"🚨 High latency detected: {duration*1000:.0f}ms > 1000ms", file=sys.stderr, flush=True)
-            alert_high_latency(duration * 1000, threshold=1000)
+        # Check for high latency alert (1000ms threshold, rate-limited)
+        if duration_ns > 1_000_000_000:
+            now = time.monotonic()
+            if now - _last_alert_ts > _ALERT_COOLDOWN_S:
+                _last_alert_ts = now
+                ms = duration_ns // 1_000_000
+                logger.debug("High latency detected: %dms > 1000ms", ms)
+                _alert_executor.submit(_send_latency_alert, ms)
             
     except Exception as e:
-        print(f"⚠️ Failed to update inference metrics: {e}", file=sys.stderr, flush=True)
+        logger.warning("Failed to update inference metrics: %s", e)
 
-# 🆕 COUNTER HTTP REQUESTS
-from prometheus_client import Counter  # 🆕
+def update_last_inference(duration: float):
+    """Compatibilité : durée en secondes (float), cf. update_last_inference_ns."""
+    update_last_inference_ns(int(duration * 1e9))
 
+# 🆕 COUNTER HTTP REQUESTS
 # counter des requêtes HTTP (label 'method' pour GET/POST)
 cv_http_requests_total = Counter(
     "cv_http_requests_total",
@@ -235,15 +447,200 @@ cv_http_requests_total = Counter(
     ["method", "endpoint"]
 )
 
+# ⚠️ CARDINALITÉ : le label 'endpoint' doit rester borné
+# (template de route, jamais le chemin brut avec IDs / query string)
+_MAX_LABELS = 64
+
+@lru_cache(maxsize=256)
+def _get_http_child(method: str, endpoint: str):
+    """Cache des enfants .labels() (method, endpoint) du compteur HTTP."""
+    metrics = cv_http_requests_total._metrics
+    if (method, endpoint) in metrics or len(metrics) < _MAX_LABELS - 1:
+        return cv_http_requests_total.labels(method=method, endpoint=endpoint)
+    # Garde-fou : limite atteinte, tout part dans l'unique série de
+    # débordement (1 slot réservé → jamais plus de _MAX_LABELS séries)
+    return cv_http_requests_total.labels(method="other", endpoint="other")
+
 def inc_http_request(method: str, endpoint: str) -> None:
     """
-    Incrémente le compteur de requêtes HTTP.
+    Incrémente le compteur de requêtes HTTP (appliqué par lot, cf. _apply_updates).
     """
+    _enqueue(("http", method, endpoint))
+
+# 🆕 HISTOGRAM LATENCE HTTP (alimenté par PrometheusMiddleware)
+cv_http_request_duration_seconds = Histogram(
+    "cv_http_request_duration_seconds",
+    "HTTP request latency in seconds (all endpoints)"
+)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🔌 MIDDLEWARE ASGI - Instrumentation HTTP légère
+# ═══════════════════════════════════════════════════════════════════════════
+class PrometheusMiddleware:
+    """
+    Middleware ASGI pur : 1 compteur + 1 histogramme par requête
+
+    💡 POURQUOI PAS BaseHTTPMiddleware / Instrumentator ?
+    Le middleware Starlette (BaseHTTPMiddleware) ajoute un surcoût notable
+    par requête. Un middleware ASGI pur se contente d'envelopper l'appel.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._allowed_endpoints = None  # frozenset des templates de routes
+
+    def _endpoint_label(self, scope, path: str, root_path: str) -> str:
+        """Template de la route matchée (/items/{id}), sinon 'other'."""
+        routes = scope["app"].routes
+        if self._allowed_endpoints is None:
+            # Calculé au 1er appel : les routes sont incluses après setup_prometheus
+            self._allowed_endpoints = frozenset(
+                route.path for route in routes if hasattr(route, "path")
+            )
+        # scope["route"] n'est renseigné que par les APIRoute FastAPI
+        endpoint = getattr(scope.get("route"), "path", None)
+        if endpoint is None:
+            # Routes Starlette (/metrics) et Mount (/static) : matching explicite
+            # sur le chemin d'origine (le routeur a pu modifier le scope)
+            original = {"type": "http", "method": scope["method"],
+                        "path": path, "root_path": root_path}
+            for route in routes:
+                if route.matches(original)[0] == Match.FULL:
+                    endpoint = getattr(route, "path", None)
+                    break
+        return endpoint if endpoint in self._allowed_endpoints else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path, root_path = scope["path"], scope.get("root_path", "")
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            cv_http_request_duration_seconds.observe(time.perf_counter() - start)
+            inc_http_request(scope["method"], self._endpoint_label(scope, path, root_path))
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 📤 ENDPOINT /metrics - Exposition avec cache TTL
+# ═══════════════════════════════════════════════════════════════════════════
+METRICS_CACHE_TTL_S = 5.0
+# ⏱️ generate_latest() n'est appelé qu'une fois par fenêtre de 5s,
+# quel que soit le nombre de scrapes (Prometheus, Grafana, curl...)
+
+# 🔀 MODE MULTIPROCESS (uvicorn --workers N)
+# Chaque worker a son propre registre : sans agrégation, un scrape ne voit
+# qu'un worker au hasard. Si PROMETHEUS_MULTIPROC_DIR est défini (AVANT
+# l'import de prometheus_client), les valeurs sont écrites dans des fichiers
+# mmap partagés et agrégées au scrape par MultiProcessCollector.
+# ⚠️ Les collectors custom sont ré-enregistrés sur le registre agrégé :
+# - cv_avg_inference_seconds : calculée depuis les _sum/_count agrégés
+# - cv_inferencetime_ms : reflète le worker qui répond au scrape
+# - cv_prediction_confidence_quantile : fenêtre du worker qui répond au scrape
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+@lru_cache(maxsize=1)
+class AggregatedCollector:
+    """
+    Métriques agrégées de tous les workers + moyenne d'inférence
+
+    💡 Les fichiers multiprocess ne sont lus QU'UNE fois par rendu : la
+    moyenne est dérivée des familles déjà collectées.
+    """
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+        self._source = multiprocess.MultiProcessCollector(None)
+
+    def collect(self):
+        families = list(self._source.collect())
+        yield from families
+        name = self._histogram._name
+        yield AvgInferenceCollector.family(*AvgInferenceCollector.sum_and_count_from(families, name))
+
+def _metrics_registry():
+    """Registre exposé sur /metrics (agrégé si mode multiprocess)."""
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    registry.register(AggregatedCollector(inference_duration))
+    registry.register(cv_inferencetime_ms)  # Requis par l'alerte HighInferenceLatency
+    registry.register(prediction_confidence)  # Signal de drift (confiance)
+    return registry
+
+if MULTIPROC_DIR:
+    # Gauges 'live*' : ignore les fichiers des workers arrêtés
+    atexit.register(multiprocess.mark_process_dead, os.getpid())
+
+_metrics_expires_at = 0.0
+_metrics_lock = asyncio.Lock()
+_metrics_snapshot = None   # (path, stat_result) du snapshot courant
+_previous_snapshot = None  # Snapshot précédent (un scrape peut encore le lire)
+
+def _render_metrics_file():
+    """
+    Écrit l'exposition Prometheus dans un NOUVEAU fichier temporaire
+
+    💡 POURQUOI UN FICHIER ?
+    La réponse est servie en FileResponse (sendfile si le serveur ASGI
+    supporte l'extension pathsend) au lieu de recopier le corps dans
+    Response.body. /dev/shm (tmpfs) est utilisé si disponible.
+
+    ⚠️ Un fichier par rendu, jamais réécrit : le stat_result transmis à
+    FileResponse reste exact. Le snapshot précédent est conservé (scrape
+    éventuellement en cours), l'avant-dernier est supprimé.
+    """
+    global _metrics_snapshot, _previous_snapshot
+    _apply_updates()  # Le snapshot inclut les mises à jour encore en file
+    body = generate_latest(_metrics_registry())
+
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    fd, path = tempfile.mkstemp(prefix=f"cv_metrics_{os.getpid()}_", suffix=".prom", dir=shm_dir)
     try:
-        cv_http_requests_total.labels(method=method.upper(), endpoint=endpoint).inc()
-    except Exception:
-        # ne pas planter l'app si Prometheus absent
-        pass
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+            f.flush()
+            stat_result = os.fstat(f.fileno())
+    except BaseException:
+        _unlink_snapshot((path, None))
+        raise
+
+    if _metrics_snapshot is None and _previous_snapshot is None:
+        atexit.register(_cleanup_metrics_files)
+    _unlink_snapshot(_previous_snapshot)
+    _previous_snapshot = _metrics_snapshot
+    _metrics_snapshot = (path, stat_result)
+    return _metrics_snapshot
+
+def _unlink_snapshot(snapshot) -> None:
+    """Supprime un fichier snapshot (ignore s'il n'existe plus)."""
+    if snapshot is not None:
+        try:
+            os.unlink(snapshot[0])
+        except OSError:
+            pass
+
+def _cleanup_metrics_files() -> None:
+    """Supprime les snapshots /metrics à l'arrêt du process."""
+    _unlink_snapshot(_previous_snapshot)
+    _unlink_snapshot(_metrics_snapshot)
+
+async def metrics_endpoint(request):
+    """Sert le snapshot /metrics en cache, régénéré à expiration du TTL."""
+    global _metrics_expires_at
+    from starlette.responses import FileResponse
+
+    async with _metrics_lock:
+        now = time.monotonic()
+        if now >= _metrics_expires_at:
+            # Rendu + écriture hors event loop
+            await asyncio.to_thread(_render_metrics_file)
+            _metrics_expires_at = now + METRICS_CACHE_TTL_S
+        path, stat_result = _metrics_snapshot
+
+    return FileResponse(path, stat_result=stat_result, media_type=CONTENT_TYPE_LATEST)
 
 # ═══════════════════════════════════════════════════════════════════════════
 # 🔧 SETUP - Configuration de l'instrumentation Prometheus
@@ -253,14 +650,12 @@ def setup_prometheus(app):
     Configure Prometheus pour FastAPI
     Compatible avec l'API existante V2
     
-    🎯 INSTRUMENTATION AUTOMATIQUE
-    Le Instrumentator ajoute automatiquement :
-    - http_request_duration_seconds : latence par endpoint
-    - http_requests_total : nombre de requêtes par status code
-    - http_requests_in_progress : requêtes concurrentes
+    🎯 INSTRUMENTATION HTTP (PrometheusMiddleware)
+    - cv_http_requests_total : nombre de requêtes par méthode/endpoint
+    - cv_http_request_duration_seconds : latence toutes routes confondues
     
     💡 ENDPOINT /metrics
-    Exposé automatiquement au format Prometheus :
+    Exposé au format Prometheus (snapshot mis en cache METRICS_CACHE_TTL_S) :
     # HELP cv_predictions_total Total number of predictions
     # TYPE cv_predictions_total counter
     cv_predictions_total{result="cat"} 42.0
@@ -271,9 +666,11 @@ def setup_prometheus(app):
     """
     if os.getenv('ENABLE_PROMETHEUS', 'false').lower() == 'true':
         # 📊 INSTRUMENTATION EN 2 ÉTAPES
-        # 1. instrument(app) : ajoute middleware pour métriques auto
-        # 2. expose(app, endpoint="/metrics") : crée route GET /metrics
-        Instrumentator().instrument(app).expose(app, endpoint="/metrics")
+        # 1. middleware ASGI : compteur + latence par requête
+        # 2. route GET /metrics : exposition mise en cache
+        app.add_middleware(PrometheusMiddleware)
+        app.add_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+        _start_flush_thread()  # Pas de thread à l'import (tests, scripts)
         print("✅ Prometheus metrics enabled at /metrics")
         
         # 💡 FORMAT DE SORTIE /metrics
@@ -283,6 +680,98 @@ def setup_prometheus(app):
         print("ℹ️  Prometheus metrics disabled")
         # Utile en dev si on veut alléger le monitoring
 
+# ═══════════════════════════════════════════════════════════════════════════
+# 📮 FILE DE MISES À JOUR - Écritures Prometheus regroupées par lot
+# ═══════════════════════════════════════════════════════════════════════════
+FLUSH_INTERVAL_S = 0.1
+# ⏱️ Le chemin de requête ne fait qu'un put_nowait() d'un petit tuple ;
+# un thread de fond vide la file toutes les 100ms et applique un seul
+# .inc(N) par combinaison de labels (+ les observations histogramme).
+
+_update_q = queue.SimpleQueue()
+_enqueue = _update_q.put_nowait
+# ⚡ Méthode liée une fois pour toutes : 1 lookup global au lieu de
+# global + attribut à chaque appel (track_prediction, inc_http_request...)
+
+_apply_lock = threading.Lock()
+
+def _apply_updates():
+    """
+    Vide la file et applique les mises à jour agrégées par clé de labels.
+
+    🔒 Sérialisé : au retour, tout ce qui était en file avant l'appel est
+    appliqué, même si le thread de fond avait déjà dépilé une partie
+    (rendu /metrics, tests).
+    """
+    with _apply_lock:
+        _apply_pending()
+
+def _apply_pending():
+    predictions = {}
+    http_requests = {}
+    feedbacks = {}
+    durations = []
+    confidences = []
+    while True:
+        try:
+            item = _update_q.get_nowait()
+        except queue.Empty:
+            break
+        # ⚠️ Validation item par item : une entrée invalide est ignorée
+        # sans faire perdre le reste de la fenêtre
+        try:
+            kind = item[0]
+            if kind == "pred":
+                _, result, success, inference_time_ns, confidence = item
+                duration = inference_time_ns * 1e-9
+                confidence = float(confidence)
+                predictions[(result, success)] = predictions.get((result, success), 0) + 1
+                durations.append(duration)
+                if result != 'error':
+                    confidences.append(confidence)
+            elif kind == "http":
+                key = (item[1].upper(), item[2])
+                http_requests[key] = http_requests.get(key, 0) + 1
+            elif kind == "feedback":
+                feedbacks[item[1]] = feedbacks.get(item[1], 0) + 1
+        except Exception as e:
+            logger.warning("Skipping invalid metric update %r: %s", item, e)
+
+    for (result, success), n in predictions.items():
+        child = _PRED.get((result, success))
+        if child is None:
+            child = predictions_total.labels(result=result, success=str(success).lower())
+        child.inc(n)
+    for duration in durations:
+        inference_duration.observe(duration)
+    for confidence in confidences:
+        prediction_confidence.observe(confidence)
+    for (method, endpoint), n in http_requests.items():
+        _get_http_child(method, endpoint).inc(n)
+    for feedback_type, n in feedbacks.items():
+        _FEEDBACK_CHILDREN[feedback_type].inc(n)
+
+def _drain():
+    """Boucle du thread de fond : applique la file toutes les FLUSH_INTERVAL_S."""
+    while True:
+        time.sleep(FLUSH_INTERVAL_S)
+        try:
+            _apply_updates()
+        except Exception as e:
+            logger.warning("Failed to flush metric updates: %s", e)
+
+_flush_thread = None
+_flush_thread_lock = threading.Lock()
+
+def _start_flush_thread():
+    """Démarre (une seule fois) le thread de vidage de la file."""
+    global _flush_thread
+    with _flush_thread_lock:
+        if _flush_thread is None:
+            _flush_thread = threading.Thread(target=_drain, name="cv-metrics-flush", daemon=True)
+            _flush_thread.start()
+            atexit.register(_apply_updates)  # Ne pas perdre la dernière fenêtre à l'arrêt
+
 # ═══════════════════════════════════════════════════════════════════════════
 # 📝 HELPERS - Fonctions de tracking appelées par l'API
 # ═══════════════════════════════════════════════════════════════════════════
@@ -306,7 +795,8 @@ def update_db_status(is_connected: bool):
     """
     database_status.set(1 if is_connected else 0)
 
-def track_prediction(result: str, inference_time_ms: int, confidence: float, success: bool = True):
+def track_prediction(result: str, inference_time_ms: Optional[int] = None, confidence: float = 0.0,
+                     success: bool = True, inference_time_ns: Optional[int] = None):
     """
     Track une prédiction dans Prometheus
     
@@ -314,63 +804,48 @@ def track_prediction(result: str, inference_time_ms: int, confidence: float, suc
     
     Args:
         result: 'cat', 'dog', ou 'error'
-        inference_time_ms: Temps d'inférence en millisecondes
+        inference_time_ms: Temps d'inférence en millisecondes (compatibilité)
         confidence: Score de confiance (0.0 à 1.0)
         success: True si prédiction réussie
+        inference_time_ns: Temps d'inférence en nanosecondes (prioritaire,
+            mesuré avec time.perf_counter_ns())
+    
+    Raises:
+        ValueError: si ni inference_time_ms ni inference_time_ns n'est fourni
     
     💡 EXEMPLE D'INTÉGRATION
+    start_ns = time.perf_counter_ns()
     result = model.predict(image)
     track_prediction(
         result='cat',
-        inference_time_ms=250,
+        inference_time_ns=time.perf_counter_ns() - start_ns,
         confidence=0.95,
         success=True
     )
     """
-    # Incrémenter compteur de prédictions
-    predictions_total.labels(
-        result=result,
-        success=str(success).lower()
-    ).inc()
-    
-    # Enregistrer temps d'inférence (conversion ms → secondes)
-    inference_duration.observe(inference_time_ms / 1000.0)
-    
-    # Mettre à jour la moyenne d'inférence
-    try:
-        print(f"🔍 DEBUG: Calling track_inference_time with {inference_time_ms / 1000.0:.3f}s", file=sys.stderr, flush=True)
-        track_inference_time(inference_time_ms / 1000.0)
-        print(f"✅ track_inference_time called successfully", file=sys.stderr, flush=True)
-    except Exception as e:
-        print(f"❌ ERROR calling track_inference_time: {e}", file=sys.stderr, flush=True)
-    
-    # Enregistrer confiance du modèle
-    if result != 'error':
-        prediction_confidence.labels(result=result).observe(confidence)
-
-
-# Variables globales pour le calcul de la moyenne
-_inference_sum = 0.0
-_inference_count = 0
+    if inference_time_ns is None:
+        if inference_time_ms is None:
+            raise ValueError("track_prediction requires inference_time_ns or inference_time_ms")
+        inference_time_ns = inference_time_ms * 1_000_000
+    # Mise en file : compteur, temps d'inférence (1 seule observation,
+    # cv_avg_inference_seconds en dérive au scrape) et confiance du modèle
+    # sont appliqués par lot dans _apply_updates
+    _enqueue(("pred", result, success, inference_time_ns, confidence))
 
 def track_inference_time(duration: float):
-    """Track inference time in histogram and update average."""
-    global _inference_sum, _inference_count
+    """
+    Track inference time in histogram (average computed at scrape time).
+    
+    ⚠️ Ne PAS appeler en plus de track_prediction (qui observe déjà la durée) :
+    uniquement quand seul le temps d'inférence doit être enregistré.
+    """
     try:
-        # Enregistre dans l'histogramme
+        # Enregistre dans l'histogramme (cv_avg_inference_seconds en dérive)
         inference_duration.observe(duration)
         
-        # Met à jour les compteurs pour la moyenne
-        _inference_sum += duration
-        _inference_count += 1
-        
-        # Calcule et met à jour la moyenne
-        avg = _inference_sum / _inference_count
-        cv_avg_inference_seconds.set(avg)
-        
-        print(f"✅ Tracked inference {duration:.3f}s | Avg: {avg:.3f}s (n={_inference_count})", file=sys.stderr, flush=True)
+        logger.debug("Tracked inference %.3fs", duration)
     except Exception as e:
-        print(f"❌ ERROR tracking inference time: {e}", file=sys.stderr, flush=True)
+        logger.warning("Failed to track inference time: %s", e)
 
 # ═══════════════════════════════════════════════════════════════════════════
 # 🎓 CONCEPTS AVANCÉS (pour aller plus loin)
@@ -405,6 +880,6 @@ def track_inference_time(duration: float):
 # - Prometheus best practices: https://prometheus.io/docs/practices/naming/
 # - Types de métriques expliqués: https://prometheus.io/docs/concepts/metric_types/
 # - PromQL tutorial: https://prometheus.io/docs/prometheus/latest/querying/basics/
-# - FastAPI Instrumentator: https://github.com/trallnag/prometheus-fastapi-instrumentator
+# - Middleware ASGI pur: https://www.starlette.io/middleware/#pure-asgi-middleware
 #
 # ═══════════════════════════════════════════════════════════════════════════
\ No newline at end of file
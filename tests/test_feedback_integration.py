@@ -1,18 +1,42 @@
 #!/usr/bin/env python3
 """Test simple pour vérifier que les feedbacks sont enregistrés en DB"""
+import asyncio
 import httpx
+import io
+import os
 import sys
+from functools import lru_cache
 from pathlib import Path
 
 # Configuration
 API_BASE_URL = "http://localhost:8002"  # STUDENT_PORT_API depuis .env
 API_TOKEN = "?C@TSD0GS!"
 TEST_IMAGE = Path(__file__).parent.parent / "data" / "raw" / "PetImages" / "Cat" / "0.jpg"
+N_PREDICTIONS = int(os.getenv("N_PREDICTIONS", "1"))  # Prédictions envoyées en parallèle
 
-def test_health():
+def _make_fake_jpeg_bytes():
+    """Petite image test (128x128 rouge) encodée en JPEG, en mémoire"""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (128, 128), color='red').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def _load_image_bytes():
+    """Image de test (ou factice), lue une seule fois avant l'envoi des requêtes"""
+    return TEST_IMAGE.read_bytes() if TEST_IMAGE.exists() else _make_fake_jpeg_bytes()
+
+def _make_client():
+    """Client partagé : pool de connexions keep-alive réutilisées entre requêtes"""
+    return httpx.AsyncClient(
+        base_url=API_BASE_URL,
+        timeout=30,
+        limits=httpx.Limits(max_keepalive_connections=20)
+    )
+
+async def check_health(client):
     """Test du healthcheck"""
     print("🏥 Test healthcheck...")
-    response = httpx.get(f"{API_BASE_URL}/health", timeout=10)
+    response = await client.get("/health", timeout=10)
     print(f"   Status: {response.status_code}")
     data = response.json()
     print(f"   Database: {data.get('database')}")
@@ -21,48 +45,53 @@ def test_health():
     assert data['status'] in ['healthy', 'degraded']
     print("   ✅ Healthcheck OK\n")
 
-def test_prediction():
+async def _predict(client, img_bytes):
+    """Envoie une prédiction (1 requête)"""
+    files = {'file': ('test_cat.jpg', io.BytesIO(img_bytes), 'image/jpeg')}
+    data = {'rgpd_consent': 'true'}
+    headers = {'Authorization': f'Bearer {API_TOKEN}'}
+    return await client.post("/api/predict", files=files, data=data, headers=headers)
+
+async def run_predictions(client):
     """Test de prédiction avec insertion en DB"""
     print("🧠 Test prédiction...")
     
     if not TEST_IMAGE.exists():
         print(f"   ⚠️  Image de test non trouvée: {TEST_IMAGE}")
         print("   Utilisation d'une image factice...")
-        # Créer une petite image test
-        from PIL import Image
-        img = Image.new('RGB', (128, 128), color='red')
-        test_file = Path(__file__).parent / "test_cat.jpg"
-        img.save(test_file)
-        image_path = test_file
-    else:
-        image_path = TEST_IMAGE
     
-    # Envoi de la prédiction
-    with open(image_path, 'rb') as f:
-        files = {'file': ('test_cat.jpg', f, 'image/jpeg')}
-        data = {'rgpd_consent': 'true'}
-        headers = {'Authorization': f'Bearer {API_TOKEN}'}
-        
-        response = httpx.post(
-            f"{API_BASE_URL}/api/predict",
-            files=files,
-            data=data,
-            headers=headers,
-            timeout=30
-        )
+    # Image lue une seule fois : aucune lecture disque pendant les requêtes
+    img_bytes = _load_image_bytes()
     
-    print(f"   Status: {response.status_code}")
-    if response.status_code == 200:
-        result = response.json()
+    # Envoi des prédictions en parallèle
+    responses = await asyncio.gather(*(_predict(client, img_bytes) for _ in range(N_PREDICTIONS)))
+    print(f"   Statuts: {[r.status_code for r in responses]}")
+    
+    # Toutes les prédictions doivent réussir (pas seulement la dernière)
+    failed = [r for r in responses if r.status_code != 200]
+    if not failed:
+        result = responses[-1].json()
         print(f"   Prédiction: {result.get('prediction')}")
         print(f"   Confiance: {result.get('confidence')}")
         print(f"   Feedback ID: {result.get('feedback_id')}")
         print("   ✅ Prédiction réussie\n")
         return result.get('feedback_id')
     else:
-        print(f"   ❌ Erreur: {response.text}")
+        print(f"   ❌ {len(failed)}/{len(responses)} en erreur: {failed[0].text}")
         return None
 
+@lru_cache(maxsize=1)
+def _last_with_count_stmt():
+    """Dernier enregistrement + total (COUNT(*) OVER ()) : 1 seul aller-retour"""
+    from sqlalchemy import func, select
+    from src.database.models import PredictionFeedback
+    
+    return (
+        select(PredictionFeedback, func.count().over().label("total"))
+        .order_by(PredictionFeedback.id.desc())
+        .limit(1)
+    )
+
 def verify_in_database():
     """Vérification directe en base de données"""
     print("🗄️  Vérification en base de données...")
@@ -70,19 +99,15 @@ def verify_in_database():
     # Import après s'assurer que .env est chargé
     sys.path.insert(0, str(Path(__file__).parent.parent))
     from src.database.db_connector import get_db_session
-    from src.database.models import PredictionFeedback
     
     db = get_db_session()
     try:
-        # Compter les enregistrements
-        count = db.query(PredictionFeedback).count()
+        # Dernier enregistrement et nombre total en une requête
+        row = db.execute(_last_with_count_stmt()).first()
+        last, count = row if row else (None, 0)
         print(f"   Nombre total d'enregistrements: {count}")
         
-        # Récupérer le dernier
         if count > 0:
-            last = db.query(PredictionFeedback).order_by(
-                PredictionFeedback.id.desc()
-            ).first()
             print(f"   Dernier enregistrement:")
             print(f"     - ID: {last.id}")
             print(f"     - Résultat: {last.prediction_result}")
@@ -99,13 +124,29 @@ def verify_in_database():
     finally:
         db.close()
 
-if __name__ == "__main__":
-    try:
+async def _with_client(check):
+    """Exécute un test async avec un client créé (puis fermé) pour l'occasion"""
+    async with _make_client() as client:
+        return await check(client)
+
+def test_health():
+    asyncio.run(_with_client(check_health))
+
+def test_prediction():
+    asyncio.run(_with_client(run_predictions))
+
+async def main():
+    async with _make_client() as client:
         # Test 1: Health check
-        test_health()
+        await check_health(client)
         
         # Test 2: Prédiction
-        feedback_id = test_prediction()
+        return await run_predictions(client)
+
+if __name__ == "__main__":
+    try:
+        # Tests 1 & 2: Health check + Prédiction(s)
+        feedback_id = asyncio.run(main())
         
         # Test 3: Vérification DB
         count = verify_in_database()
@@ -74,4 +74,151 @@ class TestDockerHealth:
         """L'app démarre même si Prometheus désactivé"""
         os.environ['ENABLE_PROMETHEUS'] = 'false'
         response = client.get("/health")
-        assert response.status_code == 200
\ No newline at end of file
+        assert response.status_code == 200
+
+class TestMetricUpdateQueue:
+    """Tests de la file de mises à jour Prometheus (application par lot)"""
+    
+    def test_apply_updates_flushes_queued_metrics(self):
+        """_apply_updates applique compteurs, histogramme et feedbacks en file"""
+        from src.monitoring import prometheus_metrics as pm
+        
+        pm._apply_updates()  # Part d'une file vide
+        http_child = pm._get_http_child('POST', '/api/predict')
+        pred_before = pm._PRED_CAT_OK._value.get()
+        count_before = sum(b.get() for b in pm.inference_duration._buckets)
+        sum_before = pm.inference_duration._sum.get()
+        http_before = http_child._value.get()
+        feedback_before = pm._FEEDBACK_CHILDREN['positive']._value.get()
+        
+        pm.track_prediction('cat', inference_time_ms=250, confidence=0.9)
+        pm.inc_http_request('post', '/api/predict')
+        pm.track_user_feedback('positive')
+        pm._apply_updates()
+        
+        assert pm._PRED_CAT_OK._value.get() == pred_before + 1
+        assert sum(b.get() for b in pm.inference_duration._buckets) == count_before + 1
+        assert pm.inference_duration._sum.get() == pytest.approx(sum_before + 0.25)
+        assert http_child._value.get() == http_before + 1
+        assert pm._FEEDBACK_CHILDREN['positive']._value.get() == feedback_before + 1
+    
+    def test_invalid_update_does_not_drop_window(self):
+        """Une entrée invalide est ignorée sans perdre les autres mises à jour"""
+        from src.monitoring import prometheus_metrics as pm
+        
+        pm._apply_updates()
+        pred_before = pm._PRED_DOG_OK._value.get()
+        
+        pm.track_prediction('dog', inference_time_ms=100, confidence=0.8)
+        pm.inc_http_request(None, '/x')  # method invalide
+        pm._apply_updates()
+        
+        assert pm._PRED_DOG_OK._value.get() == pred_before + 1
+
+class TestEndpointLabels:
+    """Tests du label 'endpoint' posé par PrometheusMiddleware (cardinalité bornée)"""
+    
+    @staticmethod
+    def _client():
+        from fastapi import FastAPI
+        from starlette.responses import PlainTextResponse
+        from starlette.routing import Route
+        from src.monitoring import prometheus_metrics as pm
+        
+        async def plain(request):
+            return PlainTextResponse("ok")
+        
+        test_app = FastAPI()
+        test_app.add_middleware(pm.PrometheusMiddleware)
+        
+        @test_app.get("/items/{item_id}")
+        def read_item(item_id: int):
+            return {"item_id": item_id}
+        
+        test_app.router.routes.append(Route("/plain", plain))
+        test_app.mount("/static", PlainTextResponse("static"))
+        return TestClient(test_app)
+    
+    @staticmethod
+    def _count(endpoint, method='GET'):
+        from prometheus_client import REGISTRY
+        from src.monitoring import prometheus_metrics as pm
+        
+        pm._apply_updates()
+        value = REGISTRY.get_sample_value(
+            'cv_http_requests_total', {'method': method, 'endpoint': endpoint}
+        )
+        return value or 0.0
+    
+    def _assert_label(self, path, expected):
+        test_client = self._client()
+        before = self._count(expected)
+        test_client.get(path)
+        assert self._count(expected) == before + 1
+    
+    def test_path_params_use_route_template(self):
+        """/items/42 est compté sous le template /items/{item_id}"""
+        self._assert_label("/items/42", "/items/{item_id}")
+    
+    def test_starlette_route_label(self):
+        """Une Route Starlette (sans scope['route']) garde son chemin"""
+        self._assert_label("/plain", "/plain")
+    
+    def test_mount_label(self):
+        """Un Mount (/static/...) est compté sous son préfixe"""
+        self._assert_label("/static/app.css", "/static")
+    
+    def test_unmatched_path_is_other(self):
+        """Un chemin inconnu part dans 'other' (jamais le chemin brut)"""
+        self._assert_label("/does/not/exist?id=123", "other")
+    
+    def test_label_cap_collapses_to_other(self, monkeypatch):
+        """Au-delà de _MAX_LABELS, les nouvelles séries partent dans (other, other)"""
+        import uuid
+        from src.monitoring import prometheus_metrics as pm
+        
+        overflow = pm.cv_http_requests_total.labels(method='other', endpoint='other')
+        # 1 seul slot libre avant le slot réservé au débordement
+        monkeypatch.setattr(pm, '_MAX_LABELS', len(pm.cv_http_requests_total._metrics) + 2)
+        pm._get_http_child.cache_clear()
+        try:
+            first = pm._get_http_child('GET', f'/cap/{uuid.uuid4().hex}')
+            second = pm._get_http_child('GET', f'/cap/{uuid.uuid4().hex}')
+            assert first is not overflow
+            assert second is overflow
+        finally:
+            pm._get_http_child.cache_clear()
+
+class TestConfidenceQuantiles:
+    """Tests des quantiles de confiance (nearest-rank, fenêtre glissante)"""
+    
+    @staticmethod
+    def _quantiles(values, window=1000):
+        from src.monitoring.prometheus_metrics import ConfidenceQuantileCollector
+        
+        collector = ConfidenceQuantileCollector(window=window)
+        for value in values:
+            collector.observe(value)
+        family, = collector.collect()
+        return {float(s.labels['quantile']): s.value for s in family.samples}
+    
+    def test_single_value(self):
+        """n=1 : tous les quantiles valent l'unique observation"""
+        assert self._quantiles([0.7]) == {0.5: 0.7, 0.9: 0.7, 0.95: 0.7, 0.99: 0.7}
+    
+    def test_two_values(self):
+        """n=2 : la médiane est la plus petite valeur, les hauts quantiles la plus grande"""
+        assert self._quantiles([0.9, 0.1]) == {0.5: 0.1, 0.9: 0.9, 0.95: 0.9, 0.99: 0.9}
+    
+    def test_four_values(self):
+        """n=4 : médiane = 2e valeur triée (rang ceil(0.5 * 4) = 2)"""
+        assert self._quantiles([0.4, 0.1, 0.3, 0.2]) == {0.5: 0.2, 0.9: 0.4, 0.95: 0.4, 0.99: 0.4}
+    
+    def test_empty_window_has_no_samples(self):
+        """Aucune observation : pas de quantile exposé"""
+        assert self._quantiles([]) == {}
+    
+    def test_window_respects_maxlen(self):
+        """Seules les `window` dernières observations sont prises en compte"""
+        quantiles = self._quantiles([0.1, 0.2, 0.3, 0.4, 0.5], window=3)
+        assert quantiles == {0.5: 0.4, 0.9: 0.5, 0.95: 0.5, 0.99: 0.5}